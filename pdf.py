@@ -2,24 +2,236 @@ import sys
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QVBoxLayout, QHBoxLayout, 
                              QWidget, QPushButton, QLabel, QLineEdit, QListWidget, 
                              QTextEdit, QGroupBox, QMessageBox, QFileDialog, QSpinBox,
-                             QCheckBox, QComboBox)
+                             QCheckBox, QComboBox, QDialog)
 from PyQt5.QtCore import QThread, pyqtSignal, QTimer
-from PyQt5.QtGui import QPixmap
+from PyQt5.QtGui import QPixmap, QImage
 import pyautogui
-from PIL import Image
+from PIL import Image, ImageChops, TiffImagePlugin
 import os
+import io
+import re
+import mmap
+import threading
+import zlib
+import hashlib
+import zipfile
 from datetime import datetime
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4, landscape
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfbase import pdfdoc
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait
 import time
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import pikepdf
+except ImportError:
+    pikepdf = None
+
+class SpoolFrame:
+    """暂存文件中的一帧：只记录位置信息，可传给子进程，按需从内存映射读取"""
+    
+    __slots__ = ("path", "offset", "size", "mode", "image_size")
+    
+    def __init__(self, path, offset, size, mode, image_size):
+        self.path = path
+        self.offset = offset
+        self.size = size
+        self.mode = mode
+        self.image_size = image_size
+        
+    def __getstate__(self):
+        return (self.path, self.offset, self.size, self.mode, self.image_size)
+        
+    def __setstate__(self, state):
+        self.path, self.offset, self.size, self.mode, self.image_size = state
+        
+    def load(self):
+        """直接从内存映射构造图像，不经过PNG解码；暂存文件已删除或映射已关闭时返回 None"""
+        with _spool_lock:
+            try:
+                mm = open_spool_map(self.path)
+                view = memoryview(mm)[self.offset:self.offset + self.size]
+            except (OSError, ValueError):
+                return None
+        return Image.frombuffer(self.mode, self.image_size, view, "raw", self.mode, 0, 1)
+
+# 每个进程各自缓存已打开的暂存文件映射；导出线程和编码线程共用，取用和关闭都要持锁
+_spool_maps = {}
+_spool_lock = threading.Lock()
+
+def open_spool_map(path):
+    mm = _spool_maps.get(path)
+    if mm is None:
+        with open(path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        _spool_maps[path] = mm
+    return mm
+
+def release_spool_map(path):
+    with _spool_lock:
+        mm = _spool_maps.pop(path, None)
+        if mm is not None:
+            try:
+                mm.close()
+            except BufferError:
+                # 仍有图像引用这块映射，交给垃圾回收释放
+                pass
+
+class FrameSpool:
+    """截图原始像素暂存文件：循环中只追加未压缩的原始数据，导出时直接读取，空闲时再编码成PNG
+    
+    每帧的位置和目标文件名同步追加到同名的 .idx 索引文件，程序中途退出后下次启动仍能恢复。
+    """
+    
+    def __init__(self, path, recover=False):
+        self.path = path
+        self.index_path = os.path.splitext(path)[0] + ".idx"
+        self.frames = []  # (SpoolFrame, 目标文件名)
+        self.offset = 0
+        self.file = None
+        self.index_file = None
+        if recover:
+            self.load_index()
+        else:
+            self.file = open(path, "wb")
+            self.index_file = open(self.index_path, "w", encoding="utf-8")
+        
+    def __len__(self):
+        return len(self.frames)
+        
+    def append(self, image, filename):
+        data = image.tobytes()
+        self.file.write(data)
+        self.file.flush()
+        frame = SpoolFrame(self.path, self.offset, len(data), image.mode, image.size)
+        # 像素写完后才写索引，索引里的帧一定能从暂存文件完整读出
+        self.index_file.write(
+            f"{self.offset}\t{len(data)}\t{image.mode}\t{image.size[0]}\t{image.size[1]}\t{filename}\n"
+        )
+        self.index_file.flush()
+        self.frames.append((frame, filename))
+        self.offset += len(data)
+        return frame
+        
+    def load_index(self):
+        """读取索引文件，丢弃像素没有完整写入的帧"""
+        data_size = os.path.getsize(self.path)
+        with open(self.index_path, encoding="utf-8") as f:
+            for line in f:
+                # 写到一半崩溃时最后一行没有换行符，文件名可能被截断
+                if not line.endswith("\n"):
+                    continue
+                fields = line[:-1].split("\t")
+                if len(fields) != 6:
+                    continue
+                offset, size, mode, width, height, filename = fields
+                offset, size = int(offset), int(size)
+                if offset + size > data_size:
+                    continue
+                frame = SpoolFrame(self.path, offset, size, mode, (int(width), int(height)))
+                self.frames.append((frame, filename))
+                self.offset = offset + size
+        
+    def finish(self):
+        """停止写入，之后的帧都从内存映射读取"""
+        if self.file is not None:
+            self.file.close()
+            self.index_file.close()
+        
+    def encode_all(self, progress=None, is_running=None):
+        """把尚未落盘的帧编码成PNG，全部成功后删除暂存文件；出错或中止时保留暂存文件，下次启动时恢复"""
+        for n, (frame, filename) in enumerate(self.frames):
+            if is_running is not None and not is_running():
+                return False
+            if not os.path.exists(filename):
+                image = frame.load()
+                if image is None:
+                    raise FileNotFoundError(f"暂存文件不存在: {self.path}")
+                # 先写临时文件再改名，导出线程不会读到写了一半的PNG
+                temp_name = f"{filename}.partial"
+                image.save(temp_name, "PNG")
+                del image
+                os.replace(temp_name, filename)
+            if progress:
+                progress(n + 1, len(self.frames))
+        
+        self.remove()
+        return True
+        
+    def remove(self):
+        release_spool_map(self.path)
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            # Windows 下导出线程仍映射着文件时无法删除，保留索引，下次启动时由 load_leftover_spools 删除
+            return
+        if os.path.exists(self.index_path):
+            os.remove(self.index_path)
+
+def load_leftover_spools(directory="screenshots"):
+    """查找上次运行中途退出时留下的暂存文件；没有索引的暂存文件无法解码，直接删除"""
+    spools = []
+    if not os.path.isdir(directory):
+        return spools
+    
+    for name in sorted(os.listdir(directory)):
+        base_name, ext = os.path.splitext(name)
+        if not name.startswith("spool_") or ext not in (".raw", ".idx"):
+            continue
+        path = os.path.join(directory, base_name + ".raw")
+        index_path = os.path.join(directory, base_name + ".idx")
+        if ext == ".idx" and os.path.exists(path):
+            continue
+        if os.path.exists(path) and os.path.exists(index_path):
+            try:
+                spools.append(FrameSpool(path, recover=True))
+            except (OSError, ValueError) as e:
+                print(f"Debug: 读取暂存文件 {path} 失败: {e}")
+        else:
+            os.remove(os.path.join(directory, name))
+    return spools
+
+def get_capture_region(capture_mode, capture_area):
+    """按截图模式返回截图区域 (x, y, 宽, 高)，全屏时返回 None"""
+    if capture_mode == "full_screen":
+        return None
+    elif capture_mode == "smart_window":
+        screen_width, screen_height = pyautogui.size()
+        margin_x = int(screen_width * 0.1)
+        margin_y = int(screen_height * 0.1)
+        return (
+            margin_x,
+            margin_y,
+            screen_width - 2 * margin_x,
+            screen_height - 2 * margin_y
+        )
+    elif capture_mode == "top_content":
+        screen_width, screen_height = pyautogui.size()
+        return (
+            0,
+            0,
+            screen_width,
+            int(screen_height * 0.7)
+        )
+    else:
+        return capture_area
+
 class CaptureThread(QThread):
     status_update = pyqtSignal(str)
     screenshot_taken = pyqtSignal(str)
     progress_update = pyqtSignal(int, int)
     finished = pyqtSignal()
     
-    def __init__(self, positions, capture_area, interval, max_clicks, auto_pdf=False, auto_exit=False, capture_mode="region", scroll_after_click=False, move_mouse_away=True, mouse_offset=100):
+    def __init__(self, positions, capture_area, interval, max_clicks, auto_pdf=False, auto_exit=False, capture_mode="region", scroll_after_click=False, move_mouse_away=True, mouse_offset=100, spool_frames=False, verify_click=False, click_retries=2):
         super().__init__()
         self.positions = positions
         self.capture_area = capture_area
@@ -31,6 +243,11 @@ class CaptureThread(QThread):
         self.scroll_after_click = scroll_after_click
         self.move_mouse_away = move_mouse_away
         self.mouse_offset = mouse_offset
+        self.spool_frames = spool_frames
+        self.verify_click = verify_click
+        self.click_retries = click_retries
+        self.click_stats = {}
+        self.spool = None
         self.screenshots = []
         self.is_running = True
         
@@ -58,6 +275,11 @@ class CaptureThread(QThread):
         print(f"Debug: 位置列表: {self.positions}")
         print(f"Debug: 移动鼠标: {self.move_mouse_away}, 偏移距离: {self.mouse_offset}")
         
+        if self.spool_frames:
+            # 循环中只追加原始像素，PNG压缩留到全部截图结束后进行
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            self.spool = FrameSpool(f"screenshots/spool_{timestamp}.raw")
+        
         click_count = 0
         
         while self.is_running and click_count < total_clicks:
@@ -77,12 +299,19 @@ class CaptureThread(QThread):
                 )
                 time.sleep(0.5)
                 
-                pyautogui.click(x, y)
-                self.status_update.emit(
-                    f"第 {click_count + 1}/{total_clicks} 次: 已点击 ({x}, {y})"
-                )
-                
-                time.sleep(1)
+                if self.verify_click:
+                    # 画面一变化就继续，不必固定等待1秒
+                    self.click_with_verify(x, y, position_index, click_count + 1)
+                    self.status_update.emit(
+                        f"第 {click_count + 1}/{total_clicks} 次: 已点击 ({x}, {y})"
+                    )
+                else:
+                    pyautogui.click(x, y)
+                    self.status_update.emit(
+                        f"第 {click_count + 1}/{total_clicks} 次: 已点击 ({x}, {y})"
+                    )
+                    
+                    time.sleep(1)
                 
                 if self.scroll_after_click:
                     self.status_update.emit(f"第 {click_count + 1} 次: 正在刷新页面...")
@@ -120,9 +349,12 @@ class CaptureThread(QThread):
                 
                 timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")[:-3]
                 filename = f"screenshots/screenshot_{timestamp}_{click_count + 1:03d}.png"
-                screenshot.save(filename)
-                
-                self.screenshots.append((screenshot, filename))
+                if self.spool is not None:
+                    frame = self.spool.append(screenshot, filename)
+                    self.screenshots.append((frame, filename))
+                else:
+                    screenshot.save(filename)
+                    self.screenshots.append((screenshot, filename))
                 self.screenshot_taken.emit(filename)
                 
                 self.status_update.emit(
@@ -150,6 +382,18 @@ class CaptureThread(QThread):
                 print(f"Debug: {error_msg}")
                 click_count += 1
                 continue
+        
+        if self.spool is not None:
+            # 暂存文件保留给导出直接读取，PNG编码在空闲时另行进行
+            self.spool.finish()
+                
+        for position_index, (clicks, misses) in sorted(self.click_stats.items()):
+            stats_msg = (
+                f"位置{position_index + 1}: 点击 {clicks} 次，"
+                f"未生效 {misses} 次 ({misses / clicks:.0%})"
+            )
+            self.status_update.emit(stats_msg)
+            print(f"Debug: {stats_msg}")
                 
         if self.is_running:
             total_cycles = (click_count - 1) // total_positions + 1 if click_count > 0 else 0
@@ -163,37 +407,276 @@ class CaptureThread(QThread):
     
     def take_screenshot(self):
         try:
-            if self.capture_mode == "full_screen":
-                return pyautogui.screenshot()
-            elif self.capture_mode == "smart_window":
-                screen_width, screen_height = pyautogui.size()
-                margin_x = int(screen_width * 0.1)
-                margin_y = int(screen_height * 0.1)
-                smart_area = (
-                    margin_x,
-                    margin_y,
-                    screen_width - 2 * margin_x,
-                    screen_height - 2 * margin_y
-                )
-                return pyautogui.screenshot(region=smart_area)
-            elif self.capture_mode == "top_content":
-                screen_width, screen_height = pyautogui.size()
-                top_area = (
-                    0,
-                    0,
-                    screen_width,
-                    int(screen_height * 0.7)
-                )
-                return pyautogui.screenshot(region=top_area)
-            else:
-                return pyautogui.screenshot(region=self.capture_area)
+            return pyautogui.screenshot(region=get_capture_region(self.capture_mode, self.capture_area))
         except Exception as e:
             print(f"截图失败: {e}")
             return None
+            
+    def grab_probe(self, width=160):
+        """截取截图区域的低分辨率灰度缩略图，用来快速判断点击后画面是否变化"""
+        image = self.take_screenshot()
+        if image is None:
+            return None
+        factor = max(1, image.size[0] // width)
+        return image.convert("L").reduce(factor)
+        
+    def probe_changed(self, before, after, threshold=16, ratio=0.002):
+        if before is None or after is None or before.size != after.size:
+            return True
+        histogram = ImageChops.difference(before, after).histogram()
+        changed = sum(histogram[threshold:])
+        return changed > ratio * before.size[0] * before.size[1]
+        
+    def wait_for_change(self, before, deadline=1.0, poll=0.1):
+        """在 deadline 秒内轮询截图区域，画面一有变化立即返回 True"""
+        end_time = time.time() + deadline
+        while self.is_running:
+            time.sleep(poll)
+            if self.probe_changed(before, self.grab_probe()):
+                return True
+            if time.time() >= end_time:
+                return False
+        return False
+        
+    def click_with_verify(self, x, y, position_index, step, hover_delay=0.3):
+        """点击后确认画面有变化，没有变化时按退避间隔重试点击，并记录每个位置的未生效次数"""
+        # 先把鼠标移到目标上，等悬停高亮、提示框出现后再取对照画面，否则悬停效果会被当成点击生效
+        pyautogui.moveTo(x, y)
+        time.sleep(hover_delay)
+        before = self.grab_probe()
+        pyautogui.click(x, y)
+        # 等待时间跟随点击间隔：响应慢的页面在间隔内刷新也算点击生效，不会被误判后重复点击而跳页
+        deadline = max(1.0, self.interval - 0.5)
+        changed = self.wait_for_change(before, deadline)
+        
+        retries = 0
+        while not changed and self.is_running and retries < self.click_retries:
+            time.sleep(0.2 * 2 ** retries)
+            # 退避期间画面才变化时说明上一次点击已经生效，不再重试
+            if self.probe_changed(before, self.grab_probe()):
+                changed = True
+                break
+            retries += 1
+            self.status_update.emit(
+                f"第 {step} 次: 画面没有变化，重试点击 ({retries}/{self.click_retries})"
+            )
+            pyautogui.click(x, y)
+            changed = self.wait_for_change(before, deadline)
+        
+        stats = self.click_stats.setdefault(position_index, [0, 0])  # [点击次数, 未生效次数]
+        stats[0] += 1
+        if not changed:
+            stats[1] += 1
+            self.status_update.emit(f"第 {step} 次: 重试 {retries} 次后画面仍无变化，继续截图")
+        return changed
+        
+    def stop(self):
+        self.is_running = False
+
+class ExportCancelled(Exception):
+    pass
+
+class ExportThread(QThread):
+    """在后台线程生成输出文件，按页报告进度，可以随时取消"""
+    status_update = pyqtSignal(str)
+    progress_update = pyqtSignal(int, int)
+    finished = pyqtSignal()
+    
+    def __init__(self, filename, export_func, auto=False):
+        super().__init__()
+        self.filename = filename
+        self.export_func = export_func  # export_func(临时文件名, progress)
+        self.auto = auto
+        self.error = None
+        self.cancelled = False
+        self.is_running = True
+        
+    def run(self):
+        # 先写到同目录的临时文件，完成后再替换，取消或出错时不会留下写了一半的文件
+        base_name, ext = os.path.splitext(self.filename)
+        temp_filename = f"{base_name}.partial{ext}"
+        
+        try:
+            self.status_update.emit(f"正在生成: {os.path.basename(self.filename)}")
+            self.export_func(temp_filename, self.report_progress)
+            os.replace(temp_filename, self.filename)
+        except ExportCancelled:
+            self.cancelled = True
+        except Exception as e:
+            self.error = str(e)
+            print(f"Debug: 生成 {self.filename} 失败: {e}")
+        finally:
+            if os.path.exists(temp_filename):
+                os.remove(temp_filename)
+        
+        self.finished.emit()
+        
+    def report_progress(self, current, total):
+        if not self.is_running:
+            raise ExportCancelled()
+        self.progress_update.emit(current, total)
+        
+    def stop(self):
+        self.is_running = False
+
+class SpoolEncodeThread(QThread):
+    """截图结束后以最低优先级把暂存帧编码成PNG，不影响导出直接读取暂存文件"""
+    status_update = pyqtSignal(str)
+    finished = pyqtSignal()
+    
+    def __init__(self, spool):
+        super().__init__()
+        self.spool = spool
+        self.error = None
+        self.is_running = True
+        
+    def run(self):
+        try:
+            done = self.spool.encode_all(
+                lambda done, total: self.status_update.emit(f"后台编码截图: {done}/{total}"),
+                lambda: self.is_running
+            )
+            if done:
+                self.status_update.emit(f"已编码 {len(self.spool)} 张截图")
+        except Exception as e:
+            # 暂存文件保留，截图仍可从暂存文件读取
+            self.error = str(e)
+            self.status_update.emit(f"编码截图出错，已保留暂存文件 {self.spool.path}: {str(e)}")
+            print(f"Debug: 编码截图出错: {e}")
+        
+        self.finished.emit()
+        
+    def stop(self):
+        self.is_running = False
+
+class PreviewThread(QThread):
+    """按设定帧率持续截取区域，缩小后发给预览窗口，画面没变化时不重绘"""
+    frame_ready = pyqtSignal(QImage)
+    stats_update = pyqtSignal(float, float, int)  # 实际帧率, 平均截图耗时(毫秒), 跳过的重绘数
+    
+    def __init__(self, region, fps=5, max_size=(640, 400)):
+        super().__init__()
+        self.region = region
+        self.fps = fps
+        self.max_size = max_size
+        self.last_image = None
+        self.is_running = True
         
+    def run(self):
+        last_data = None
+        frames = 0
+        skipped = 0
+        capture_time = 0.0
+        stats_start = time.time()
+        
+        while self.is_running:
+            frame_start = time.time()
+            try:
+                image = pyautogui.screenshot(region=self.region)
+            except Exception as e:
+                print(f"预览截图失败: {e}")
+                time.sleep(1)
+                continue
+            capture_time += time.time() - frame_start
+            frames += 1
+            self.last_image = image
+            
+            # reduce 按整数倍做盒式缩小，比任意尺寸缩放快得多
+            factor = max(1, -(-image.size[0] // self.max_size[0]), -(-image.size[1] // self.max_size[1]))
+            preview = image.convert("RGB").reduce(factor)
+            data = preview.tobytes()
+            if data == last_data:
+                skipped += 1
+            else:
+                last_data = data
+                width, height = preview.size
+                self.frame_ready.emit(QImage(data, width, height, width * 3, QImage.Format_RGB888).copy())
+            
+            elapsed = time.time() - stats_start
+            if elapsed >= 1:
+                self.stats_update.emit(frames / elapsed, capture_time / frames * 1000, skipped)
+                frames = 0
+                skipped = 0
+                capture_time = 0.0
+                stats_start = time.time()
+            
+            time.sleep(max(0, 1 / self.fps - (time.time() - frame_start)))
+            
     def stop(self):
         self.is_running = False
 
+class PreviewDialog(QDialog):
+    """截图区域实时预览，同时显示当前截图方式在本机能达到的帧率和耗时"""
+    
+    def __init__(self, parent, region):
+        super().__init__(parent)
+        self.setWindowTitle("实时预览")
+        layout = QVBoxLayout(self)
+        
+        self.image_label = QLabel("正在截图...")
+        self.image_label.setMinimumSize(320, 200)
+        layout.addWidget(self.image_label)
+        
+        control_layout = QHBoxLayout()
+        control_layout.addWidget(QLabel("帧率:"))
+        self.fps_spin = QSpinBox()
+        self.fps_spin.setRange(1, 30)
+        self.fps_spin.setValue(5)
+        self.fps_spin.setSuffix(" 帧/秒")
+        self.fps_spin.valueChanged.connect(self.set_fps)
+        control_layout.addWidget(self.fps_spin)
+        
+        self.save_btn = QPushButton("保存当前帧")
+        self.save_btn.clicked.connect(self.save_frame)
+        control_layout.addWidget(self.save_btn)
+        control_layout.addStretch()
+        layout.addLayout(control_layout)
+        
+        self.stats_label = QLabel("实际帧率: - | 截图耗时: -")
+        self.stats_label.setStyleSheet("color: gray; font-size: 10px;")
+        layout.addWidget(self.stats_label)
+        
+        self.preview_thread = PreviewThread(region, self.fps_spin.value())
+        self.preview_thread.frame_ready.connect(self.show_frame)
+        self.preview_thread.stats_update.connect(self.show_stats)
+        self.preview_thread.start()
+        
+    def set_region(self, region):
+        self.preview_thread.region = region
+        
+    def set_fps(self, fps):
+        self.preview_thread.fps = fps
+        
+    def show_frame(self, image):
+        self.image_label.setPixmap(QPixmap.fromImage(image))
+        
+    def show_stats(self, fps, latency, skipped):
+        self.stats_label.setText(
+            f"实际帧率: {fps:.1f} 帧/秒 | 截图耗时: {latency:.0f} 毫秒 | 画面未变化跳过: {skipped} 次"
+        )
+        
+    def save_frame(self):
+        screenshot = self.preview_thread.last_image
+        if screenshot is None:
+            return
+        try:
+            if not os.path.exists("test_screenshots"):
+                os.makedirs("test_screenshots")
+            
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            test_filename = f"test_screenshots/test_{timestamp}.png"
+            screenshot.save(test_filename)
+            
+            QMessageBox.information(self, "成功", f"测试截图已保存: {test_filename}\n截图尺寸: {screenshot.size[0]} x {screenshot.size[1]}")
+            
+        except Exception as e:
+            QMessageBox.critical(self, "错误", f"测试截图失败: {str(e)}")
+            
+    def done(self, result):
+        self.preview_thread.stop()
+        self.preview_thread.wait()
+        super().done(result)
+
 class ScreenCaptureApp(QMainWindow):
     def __init__(self):
         super().__init__()
@@ -204,8 +687,13 @@ class ScreenCaptureApp(QMainWindow):
         self.capture_area = (100, 100, 800, 600)
         self.screenshots = []
         self.capture_thread = None
+        self.export_threads = []
+        self.spool_threads = []
+        self.exit_after_export = False
+        self.preview_dialog = None
         
         self.init_ui()
+        self.recover_spools()
         
         self.timer = QTimer()
         self.timer.timeout.connect(self.update_info)
@@ -287,6 +775,15 @@ class ScreenCaptureApp(QMainWindow):
         self.scroll_cb = QCheckBox("点击后轻微滚动页面(帮助刷新内容)")
         self.scroll_cb.setChecked(True)
         interval_layout.addWidget(self.scroll_cb)
+        
+        self.verify_click_cb = QCheckBox("点击后校验画面变化")
+        self.verify_click_cb.setToolTip("点击后画面没有变化时快速重试点击，并统计每个位置的未生效次数")
+        interval_layout.addWidget(self.verify_click_cb)
+        interval_layout.addWidget(QLabel("重试次数:"))
+        self.click_retries_spin = QSpinBox()
+        self.click_retries_spin.setRange(0, 10)
+        self.click_retries_spin.setValue(2)
+        interval_layout.addWidget(self.click_retries_spin)
         interval_layout.addStretch()
         
         # 鼠标移动设置
@@ -316,6 +813,23 @@ class ScreenCaptureApp(QMainWindow):
         clicks_layout.addWidget(self.cycle_info_label)
         clicks_layout.addStretch()
         
+        # 输出格式
+        output_layout = QHBoxLayout()
+        output_layout.addWidget(QLabel("输出格式:"))
+        self.output_format_combo = QComboBox()
+        self.output_format_combo.addItems([
+            "PDF",
+            "CBZ漫画包",
+            "ZIP压缩包",
+            "多页TIFF"
+        ])
+        output_layout.addWidget(self.output_format_combo)
+        
+        output_description = QLabel("CBZ/ZIP直接打包截图PNG不再压缩，多页TIFF逐帧写入")
+        output_description.setStyleSheet("color: gray; font-size: 10px;")
+        output_layout.addWidget(output_description)
+        output_layout.addStretch()
+        
         # PDF生成选项
         pdf_layout = QHBoxLayout()
         pdf_layout.addWidget(QLabel("PDF布局:"))
@@ -333,12 +847,65 @@ class ScreenCaptureApp(QMainWindow):
         pdf_layout.addWidget(pdf_description)
         pdf_layout.addStretch()
         
+        # PDF输出选项
+        pdf_option_layout = QHBoxLayout()
+        self.shard_pdf_cb = QCheckBox("分片并行生成PDF(多进程)")
+        self.shard_pdf_cb.setToolTip("截图很多时按CPU核数分片渲染再合并，需要安装 pikepdf")
+        self.keep_volumes_cb = QCheckBox("保留分卷文件")
+        self.linearize_cb = QCheckBox("线性化输出(快速网页浏览)")
+        self.linearize_cb.setToolTip("首页可在文件下载完成前显示，适合通过HTTP分段读取的大文件，需要安装 pikepdf")
+        pdf_option_layout.addWidget(self.shard_pdf_cb)
+        pdf_option_layout.addWidget(self.keep_volumes_cb)
+        pdf_option_layout.addWidget(self.linearize_cb)
+        self.compact_pdf_cb = QCheckBox("紧凑结构(对象流/交叉引用流)")
+        self.compact_pdf_cb.setToolTip("输出PDF 1.5对象流和压缩的交叉引用流并共享页面资源，页数很多时文件更小、打开更快，需要安装 pikepdf")
+        pdf_option_layout.addWidget(self.compact_pdf_cb)
+        pdf_option_layout.addStretch()
+        
+        # 图像编码选项
+        encode_layout = QHBoxLayout()
+        self.tile_dedup_cb = QCheckBox("重复区域分块去重(工具栏/页眉等)")
+        self.tile_dedup_cb.setToolTip("把截图切成小块，各页相同的分块只嵌入一次，适合同一应用或网站的连续截图")
+        encode_layout.addWidget(self.tile_dedup_cb)
+        encode_layout.addWidget(QLabel("分块大小:"))
+        self.tile_size_spin = QSpinBox()
+        self.tile_size_spin.setRange(16, 512)
+        self.tile_size_spin.setSingleStep(16)
+        self.tile_size_spin.setValue(128)
+        self.tile_size_spin.setSuffix(" 像素")
+        encode_layout.addWidget(self.tile_size_spin)
+        
+        encode_layout.addWidget(QLabel("颜色模式:"))
+        self.color_mode_combo = QComboBox()
+        self.color_mode_combo.addItems([
+            "彩色",
+            "自动识别灰度",
+            "灰度(8位)",
+            "黑白(1位)"
+        ])
+        self.color_mode_combo.setToolTip("文档、幻灯片等以黑白文字为主的截图可用灰度或黑白，PDF体积更小")
+        encode_layout.addWidget(self.color_mode_combo)
+        
+        self.image_cache_cb = QCheckBox("缓存已编码图像")
+        self.image_cache_cb.setToolTip("像素相同的截图在以后生成PDF时直接复用已压缩的数据，缓存保存在 image_cache/ 目录")
+        encode_layout.addWidget(self.image_cache_cb)
+        encode_layout.addWidget(QLabel("缓存上限:"))
+        self.cache_size_spin = QSpinBox()
+        self.cache_size_spin.setRange(16, 65536)
+        self.cache_size_spin.setValue(512)
+        self.cache_size_spin.setSuffix(" MB")
+        encode_layout.addWidget(self.cache_size_spin)
+        encode_layout.addStretch()
+        
         # 自动化选项
         auto_layout = QHBoxLayout()
-        self.auto_pdf_cb = QCheckBox("完成后自动生成PDF")
+        self.auto_pdf_cb = QCheckBox("完成后自动生成PDF/导出")
         self.auto_exit_cb = QCheckBox("完成后自动退出程序")
+        self.spool_frames_cb = QCheckBox("截图暂存原始数据，空闲时再编码")
+        self.spool_frames_cb.setToolTip("循环中不做PNG压缩，缩短每次点击截图的耗时，但需要更多临时磁盘空间")
         auto_layout.addWidget(self.auto_pdf_cb)
         auto_layout.addWidget(self.auto_exit_cb)
+        auto_layout.addWidget(self.spool_frames_cb)
         auto_layout.addStretch()
         
         config_layout.addLayout(mode_layout)
@@ -347,7 +914,10 @@ class ScreenCaptureApp(QMainWindow):
         config_layout.addLayout(interval_layout)
         config_layout.addLayout(mouse_layout)
         config_layout.addLayout(clicks_layout)
+        config_layout.addLayout(output_layout)
         config_layout.addLayout(pdf_layout)
+        config_layout.addLayout(pdf_option_layout)
+        config_layout.addLayout(encode_layout)
         config_layout.addLayout(auto_layout)
         
         # 点击位置管理
@@ -395,7 +965,8 @@ class ScreenCaptureApp(QMainWindow):
         self.stop_btn.setEnabled(False)
         self.pdf_btn = QPushButton("生成PDF")
         self.pdf_btn.clicked.connect(self.generate_pdf)
-        self.test_screenshot_btn = QPushButton("测试截图")
+        self.output_format_combo.currentTextChanged.connect(self.on_output_format_changed)
+        self.test_screenshot_btn = QPushButton("实时预览")
         self.test_screenshot_btn.clicked.connect(self.test_screenshot)
         
         control_layout.addWidget(self.start_btn)
@@ -408,6 +979,12 @@ class ScreenCaptureApp(QMainWindow):
         progress_layout = QHBoxLayout()
         self.progress_label = QLabel("进度: 0/0")
         progress_layout.addWidget(self.progress_label)
+        self.pdf_progress_label = QLabel("")
+        progress_layout.addWidget(self.pdf_progress_label)
+        self.cancel_pdf_btn = QPushButton("取消生成")
+        self.cancel_pdf_btn.clicked.connect(self.cancel_pdf)
+        self.cancel_pdf_btn.setEnabled(False)
+        progress_layout.addWidget(self.cancel_pdf_btn)
         progress_layout.addStretch()
         
         # 状态显示
@@ -433,6 +1010,11 @@ class ScreenCaptureApp(QMainWindow):
         
         self.max_clicks_spin.valueChanged.connect(self.update_position_info)
         
+        # 预览窗口跟随截图模式和区域设置
+        self.capture_mode_combo.currentTextChanged.connect(self.update_preview_region)
+        for spin in (self.area_x, self.area_y, self.area_width, self.area_height):
+            spin.valueChanged.connect(self.update_preview_region)
+        
     def update_position_info(self):
         count = len(self.click_positions)
         total_clicks = self.max_clicks_spin.value()
@@ -498,46 +1080,28 @@ class ScreenCaptureApp(QMainWindow):
         self.area_height.setValue(int(screen_height * 0.7))
     
     def test_screenshot(self):
-        try:
-            mode_text = self.capture_mode_combo.currentText()
-            
-            if mode_text == "全屏截图":
-                screenshot = pyautogui.screenshot()
-            elif mode_text == "智能窗口截图":
-                screen_width, screen_height = pyautogui.size()
-                margin_x = int(screen_width * 0.1)
-                margin_y = int(screen_height * 0.1)
-                smart_area = (
-                    margin_x,
-                    margin_y,
-                    screen_width - 2 * margin_x,
-                    screen_height - 2 * margin_y
-                )
-                screenshot = pyautogui.screenshot(region=smart_area)
-            elif mode_text == "顶部内容截图":
-                screen_width, screen_height = pyautogui.size()
-                top_area = (0, 0, screen_width, int(screen_height * 0.7))
-                screenshot = pyautogui.screenshot(region=top_area)
-            else:
-                capture_area = (
-                    self.area_x.value(),
-                    self.area_y.value(),
-                    self.area_width.value(),
-                    self.area_height.value()
-                )
-                screenshot = pyautogui.screenshot(region=capture_area)
-            
-            if not os.path.exists("test_screenshots"):
-                os.makedirs("test_screenshots")
-            
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            test_filename = f"test_screenshots/test_{timestamp}.png"
-            screenshot.save(test_filename)
-            
-            QMessageBox.information(self, "成功", f"测试截图已保存: {test_filename}\n截图尺寸: {screenshot.size[0]} x {screenshot.size[1]}")
+        if self.preview_dialog is None:
+            self.preview_dialog = PreviewDialog(self, self.get_preview_region())
+            self.preview_dialog.finished.connect(self.preview_closed)
+        self.preview_dialog.show()
+        self.preview_dialog.raise_()
+        
+    def get_preview_region(self):
+        capture_area = (
+            self.area_x.value(),
+            self.area_y.value(),
+            self.area_width.value(),
+            self.area_height.value()
+        )
+        return get_capture_region(self.get_capture_mode(), capture_area)
+        
+    def update_preview_region(self):
+        if self.preview_dialog is not None:
+            self.preview_dialog.set_region(self.get_preview_region())
             
-        except Exception as e:
-            QMessageBox.critical(self, "错误", f"测试截图失败: {str(e)}")
+    def preview_closed(self):
+        self.preview_dialog.deleteLater()
+        self.preview_dialog = None
     
     def update_info(self):
         x, y = pyautogui.position()
@@ -639,10 +1203,13 @@ class ScreenCaptureApp(QMainWindow):
             f"• 截图模式: {mode_text}\n"
             f"• 点击间隔: {self.interval_spin.value()}秒\n"
             f"• 页面滚动: {'是' if self.scroll_cb.isChecked() else '否'}\n"
+            f"• 点击校验: {'是，最多重试' + str(self.click_retries_spin.value()) + '次' if self.verify_click_cb.isChecked() else '否'}\n"
             f"• 移动鼠标: {'是' if self.move_mouse_cb.isChecked() else '否'}\n"
+            f"• 输出格式: {self.output_format_combo.currentText()}\n"
             f"• PDF布局: {self.pdf_layout_combo.currentText()}\n"
             f"• 自动生成PDF: {'是' if self.auto_pdf_cb.isChecked() else '否'}\n"
-            f"• 自动退出: {'是' if self.auto_exit_cb.isChecked() else '否'}\n\n"
+            f"• 自动退出: {'是' if self.auto_exit_cb.isChecked() else '否'}\n"
+            f"• 批量编码: {'是' if self.spool_frames_cb.isChecked() else '否'}\n\n"
             f"预计总耗时: 约 {total_clicks * self.interval_spin.value()} 秒\n\n"
             f"确定开始循环吗？",
             QMessageBox.Yes | QMessageBox.No
@@ -651,6 +1218,10 @@ class ScreenCaptureApp(QMainWindow):
         if reply != QMessageBox.Yes:
             return
         
+        # 预览会和循环截图抢占截图资源，开始前先关闭
+        if self.preview_dialog is not None:
+            self.preview_dialog.close()
+        
         self.screenshots.clear()
         self.screenshot_list.clear()
         self.progress_label.setText("进度: 0/0")
@@ -665,7 +1236,10 @@ class ScreenCaptureApp(QMainWindow):
             capture_mode,
             self.scroll_cb.isChecked(),
             self.move_mouse_cb.isChecked(),
-            self.mouse_offset_spin.value()
+            self.mouse_offset_spin.value(),
+            self.spool_frames_cb.isChecked(),
+            self.verify_click_cb.isChecked(),
+            self.click_retries_spin.value()
         )
         
         self.capture_thread.status_update.connect(self.update_status)
@@ -698,17 +1272,99 @@ class ScreenCaptureApp(QMainWindow):
         
         if self.auto_pdf_cb.isChecked() and final_count > 0:
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            pdf_filename = f"auto_output_{timestamp}.pdf"
-            try:
-                self.create_pdf(pdf_filename)
-                self.status_label.setText(f"循环任务完成！共 {final_count} 张截图，PDF已自动生成: {pdf_filename}")
-            except Exception as e:
-                QMessageBox.critical(self, "错误", f"自动生成PDF失败: {str(e)}")
+            output_filename = f"auto_output_{timestamp}.{self.get_output_format()}"
+            self.export_output(output_filename, auto=True)
+            self.status_label.setText(f"循环任务完成！共 {final_count} 张截图，正在后台生成: {output_filename}")
+        
+        if self.capture_thread and self.capture_thread.spool is not None:
+            # 导出直接读取暂存文件，PNG在后台空闲时再编码
+            self.start_spool_encode(self.capture_thread.spool)
+            
+        if self.export_threads or self.spool_threads:
+            if self.auto_exit_cb.isChecked():
+                # 等后台生成和编码结束后再退出
+                self.exit_after_export = True
+            return
         
         if self.auto_exit_cb.isChecked():
             QMessageBox.information(self, "完成", f"循环任务已完成，共生成 {final_count} 张截图，程序将自动退出")
             QApplication.quit()
             
+    def start_spool_encode(self, spool):
+        encode_thread = SpoolEncodeThread(spool)
+        encode_thread.status_update.connect(self.update_status)
+        encode_thread.finished.connect(lambda: self.spool_encode_finished(encode_thread))
+        
+        self.spool_threads.append(encode_thread)
+        encode_thread.start(QThread.LowestPriority)
+        
+    def recover_spools(self):
+        """上次运行中途退出时留下的暂存文件在后台编码成PNG后删除"""
+        for spool in load_leftover_spools():
+            self.status_label.setText(f"正在恢复上次未编码的 {len(spool)} 张截图...")
+            self.start_spool_encode(spool)
+        
+    def spool_encode_finished(self, encode_thread):
+        encode_thread.wait()
+        self.spool_threads.remove(encode_thread)
+        self.exit_if_idle()
+        
+    def exit_if_idle(self):
+        if self.exit_after_export and not self.export_threads and not self.spool_threads:
+            QMessageBox.information(self, "完成", f"循环任务已完成，共生成 {len(self.screenshots)} 张截图，程序将自动退出")
+            QApplication.quit()
+            
+    def closeEvent(self, event):
+        if self.export_threads:
+            reply = QMessageBox.question(
+                self,
+                "确认退出",
+                "后台还在生成输出文件，关闭窗口会取消生成，确定要退出吗？",
+                QMessageBox.Yes | QMessageBox.No
+            )
+            if reply != QMessageBox.Yes:
+                event.ignore()
+                return
+        
+        if self.spool_threads:
+            reply = QMessageBox.question(
+                self,
+                "确认退出",
+                "后台还在把截图编码成PNG，是否等编码完成后再退出？\n"
+                "选择\"否\"会立即停止编码，未编码的截图保留在暂存文件中，下次启动时自动恢复。",
+                QMessageBox.Yes | QMessageBox.No | QMessageBox.Cancel
+            )
+            if reply == QMessageBox.Cancel:
+                event.ignore()
+                return
+        
+        # 不能销毁仍在运行的 QThread：先取消导出，等线程删除临时文件后再退出
+        for export_thread in self.export_threads:
+            export_thread.stop()
+        for export_thread in self.export_threads:
+            export_thread.wait()
+        
+        if self.spool_threads:
+            self.status_label.setText("正在等待后台编码结束...")
+            for encode_thread in self.spool_threads:
+                if reply == QMessageBox.No:
+                    encode_thread.stop()
+                encode_thread.wait()
+        
+        # 截图中途关闭时等循环停下，暂存文件写完索引后下次启动可以恢复
+        if self.capture_thread is not None and self.capture_thread.isRunning():
+            # 不再触发自动导出和编码
+            self.capture_thread.finished.disconnect()
+            self.capture_thread.stop()
+            self.capture_thread.wait()
+        
+        # 预览窗口关闭时会停止并等待预览线程
+        if self.preview_dialog is not None:
+            self.preview_dialog.close()
+        
+        self.exit_after_export = False
+        super().closeEvent(event)
+        
     def update_status(self, message):
         self.status_label.setText(message)
         
@@ -719,177 +1375,829 @@ class ScreenCaptureApp(QMainWindow):
         if not self.screenshots:
             QMessageBox.warning(self, "警告", "没有截图可生成PDF")
             return
-            
+        
+        output_format = self.get_output_format()
+        file_filters = {
+            "pdf": "PDF files (*.pdf)",
+            "cbz": "CBZ files (*.cbz)",
+            "zip": "ZIP files (*.zip)",
+            "tiff": "TIFF files (*.tif *.tiff)"
+        }
         filename, _ = QFileDialog.getSaveFileName(
-            self, "保存PDF文件", "", "PDF files (*.pdf)"
+            self, "保存输出文件", "", file_filters[output_format]
         )
         
         if filename:
-            try:
-                self.create_pdf(filename)
-                QMessageBox.information(self, "成功", f"PDF已保存到: {filename}")
-            except Exception as e:
-                QMessageBox.critical(self, "错误", f"生成PDF失败: {str(e)}")
+            self.export_output(filename)
+            
+    def get_output_format(self):
+        format_text = self.output_format_combo.currentText()
+        if format_text == "CBZ漫画包":
+            return "cbz"
+        elif format_text == "ZIP压缩包":
+            return "zip"
+        elif format_text == "多页TIFF":
+            return "tiff"
+        else:
+            return "pdf"
+            
+    def on_output_format_changed(self, format_text):
+        self.pdf_btn.setText("生成PDF" if format_text == "PDF" else f"导出{format_text}")
+        
+    def export_output(self, filename, auto=False):
+        """按选择的输出格式在后台导出截图"""
+        output_format = self.get_output_format()
+        if output_format == "pdf":
+            return self.create_pdf(filename, auto)
+        
+        screenshots = list(self.screenshots)
+        write_func = write_tiff if output_format == "tiff" else write_zip
+        
+        def export(temp_filename, progress):
+            write_func(temp_filename, screenshots, progress)
+        
+        return self.start_export(filename, export, auto)
                 
-    def create_pdf(self, filename):
-        """创建PDF文件，支持优化的布局"""
+    def get_encode_options(self):
+        return {
+            "tile_size": self.tile_size_spin.value() if self.tile_dedup_cb.isChecked() else 0,
+            "color_mode": self.get_color_mode(),
+            "cache_dir": "image_cache" if self.image_cache_cb.isChecked() else None,
+            "cache_size": self.cache_size_spin.value() * 1024 * 1024,
+        }
+        
+    def get_color_mode(self):
+        mode_text = self.color_mode_combo.currentText()
+        if mode_text == "自动识别灰度":
+            return "auto"
+        elif mode_text == "灰度(8位)":
+            return "gray"
+        elif mode_text == "黑白(1位)":
+            return "bilevel"
+        else:
+            return "color"
+        
+    def create_pdf(self, filename, auto=False):
+        """在后台线程创建PDF文件，支持优化的布局"""
+        # 截图列表和选项在开始时复制一份，生成过程中可以开始下一轮截图
+        screenshots = list(self.screenshots)
         layout_mode = self.pdf_layout_combo.currentText()
+        pdf_options = dict(
+            sharded=self.shard_pdf_cb.isChecked(),
+            keep_volumes=self.keep_volumes_cb.isChecked(),
+            linearize=self.linearize_cb.isChecked(),
+            compact=self.compact_pdf_cb.isChecked(),
+            volume_base=filename,
+            **self.get_encode_options()
+        )
         
-        if "横向纸张" in layout_mode:
-            # 使用横向A4纸张
-            pagesize = landscape(A4)
+        def export(temp_filename, progress):
+            write_pdf(temp_filename, screenshots, layout_mode, progress=progress, **pdf_options)
+        
+        return self.start_export(filename, export, auto)
+        
+    def start_export(self, filename, export, auto=False):
+        export_thread = ExportThread(filename, export, auto)
+        export_thread.status_update.connect(self.update_status)
+        export_thread.progress_update.connect(self.update_pdf_progress)
+        export_thread.finished.connect(lambda: self.export_finished(export_thread))
+        
+        self.export_threads.append(export_thread)
+        self.cancel_pdf_btn.setEnabled(True)
+        export_thread.start()
+        return export_thread
+        
+    def cancel_pdf(self):
+        for export_thread in self.export_threads:
+            export_thread.stop()
+        self.pdf_progress_label.setText("正在取消生成...")
+        
+    def update_pdf_progress(self, current, total):
+        self.pdf_progress_label.setText(f"生成进度: {current}/{total}")
+        
+    def export_finished(self, export_thread):
+        export_thread.wait()
+        self.export_threads.remove(export_thread)
+        self.cancel_pdf_btn.setEnabled(bool(self.export_threads))
+        self.pdf_progress_label.setText("")
+        
+        if export_thread.cancelled:
+            self.status_label.setText(f"已取消生成: {export_thread.filename}")
+        elif export_thread.error:
+            title = "自动生成失败" if export_thread.auto else "生成失败"
+            QMessageBox.critical(self, "错误", f"{title}: {export_thread.error}")
+        elif export_thread.auto:
+            self.status_label.setText(f"循环任务完成！已自动生成: {export_thread.filename}")
         else:
-            # 使用竖向A4纸张
-            pagesize = A4
+            self.status_label.setText(f"已保存到: {export_thread.filename}")
+            QMessageBox.information(self, "成功", f"已保存到: {export_thread.filename}")
+        
+        self.exit_if_idle()
+
+def get_pdf_pagesize(layout_mode):
+    if "横向纸张" in layout_mode:
+        # 使用横向A4纸张
+        return landscape(A4)
+    # 使用竖向A4纸张
+    return A4
+
+def get_images_per_page(layout_mode):
+    return 1 if layout_mode == "每页一张图片" else 2
+
+def load_frame(screenshot, img_name):
+    """返回截图图像，内存中没有时从暂存文件或截图文件读取"""
+    if isinstance(screenshot, SpoolFrame):
+        image = screenshot.load()
+        if image is not None:
+            return image
+    elif screenshot is not None:
+        return screenshot
+    image = Image.open(img_name)
+    image.load()
+    return image
+
+def is_grayscale(image, tolerance=24, ratio=0.005):
+    """抽样检查各像素RGB通道差异，几乎没有彩色像素时认为是灰度内容"""
+    if image.mode in ("1", "L"):
+        return True
+    pixels = np.asarray(image.convert("RGB"))[::4, ::4]
+    spread = pixels.max(axis=2) - pixels.min(axis=2)
+    return bool((spread > tolerance).mean() < ratio)
+
+def adaptive_threshold(gray, block=31, sensitivity=15, mid_level=128):
+    """向量化的局部均值自适应阈值：浅色背景上比周围 block×block 区域均值暗 sensitivity% 以上的像素为黑色，
+    深色背景（局部均值低于 mid_level，如标题栏）上比均值亮 sensitivity% 以上的像素为白色"""
+    pixels = np.asarray(gray, dtype=np.int64)
+    img_height, img_width = pixels.shape
+    
+    integral = np.zeros((img_height + 1, img_width + 1), dtype=np.int64)
+    integral[1:, 1:] = pixels.cumsum(axis=0).cumsum(axis=1)
+    
+    r = block // 2
+    y0 = np.clip(np.arange(img_height) - r, 0, img_height)
+    y1 = np.clip(np.arange(img_height) + r + 1, 0, img_height)
+    x0 = np.clip(np.arange(img_width) - r, 0, img_width)
+    x1 = np.clip(np.arange(img_width) + r + 1, 0, img_width)
+    
+    sums = (integral[y1][:, x1] - integral[y0][:, x1]
+            - integral[y1][:, x0] + integral[y0][:, x0])
+    counts = (y1 - y0)[:, None] * (x1 - x0)[None, :]
+    
+    # 深色背景按反相判断：平坦的深色区域保持黑色，上面的浅色文字变白而不是和背景一起变白
+    dark_background = sums < mid_level * counts
+    white = np.where(dark_background,
+                     pixels * counts * 100 > sums * (100 + sensitivity),
+                     pixels * counts * 100 > sums * (100 - sensitivity))
+    return Image.fromarray(white)
+
+def reduce_colors(image, color_mode):
+    """按颜色模式转换截图：color 原样、auto 自动识别灰度、gray 8位灰度、bilevel 1位黑白"""
+    if color_mode == "color":
+        return image
+    if color_mode == "auto":
+        return image.convert("L") if is_grayscale(image) else image
+    
+    gray = image.convert("L")
+    if color_mode == "gray":
+        return gray
+    return adaptive_threshold(gray)
+
+def encode_image(image):
+    """把图像编码成可以直接嵌入PDF的 Flate 数据流，返回 (宽, 高, 颜色空间, 位深, 数据流)"""
+    if image.mode == "1":
+        color_space, bits = "DeviceGray", 1
+    elif image.mode == "L":
+        color_space, bits = "DeviceGray", 8
+    else:
+        image = image.convert("RGB")
+        color_space, bits = "DeviceRGB", 8
+    width, height = image.size
+    return width, height, color_space, bits, zlib.compress(image.tobytes())
+
+def draw_image(c, image, x, y, width, height):
+    """1位黑白图按 BitsPerComponent 1 嵌入，其余交给 reportlab 的 drawImage"""
+    if getattr(image, "mode", None) != "1":
+        if not isinstance(image, ImageReader):
+            image = ImageReader(image)
+        c.drawImage(image, x, y, width=width, height=height)
+        return
+    
+    # reportlab 会把1位图转成RGB，这里自己登记图像对象
+    name = "bilevel_" + hashlib.md5(image.tobytes()).hexdigest()
+    draw_image_stream(c, name, lambda: encode_image(image), x, y, width, height)
+
+def draw_image_stream(c, name, encode, x, y, width, height):
+    """按 drawImage 的方式登记并绘制已编码的图像；同名图像只在第一次时调用 encode() 嵌入
+    
+    这里用到 reportlab 画布的内部接口，升级 reportlab 后先运行 tests/test_pdf_images.py 确认输出正常。
+    """
+    reg_name = c._doc.getXObjectName(name)
+    if reg_name not in c._doc.idToObject:
+        image_obj = pdfdoc.PDFImageXObject(name)
+        (image_obj.width, image_obj.height, image_obj.colorSpace,
+         image_obj.bitsPerComponent, image_obj.streamContent) = encode()
+        image_obj._filters = ("FlateDecode",)
+        image_obj.mask = None
+        # 图像对象没有自己的资源字典，不需要像 drawImage 那样调用 _setXObjects
+        c._doc.Reference(image_obj, reg_name)
+        c._doc.addForm(name, image_obj)
+    
+    c.saveState()
+    c.translate(x, y)
+    c.scale(width, height)
+    c._code.append("/%s Do" % reg_name)
+    c.restoreState()
+    
+    # 每页只登记一次，分块很多时页面资源字典不会被重复的名字撑大；换页时 reportlab 会换一个新的列表
+    in_use = getattr(c, "_image_streams_in_use", None)
+    if in_use is None or in_use[0] is not c._formsinuse:
+        in_use = c._image_streams_in_use = (c._formsinuse, set())
+    if name not in in_use[1]:
+        in_use[1].add(name)
+        c._formsinuse.append(name)
+
+class ImageCache:
+    """按像素内容和编码设置寻址的已编码图像缓存，跨次运行复用，超过容量上限时淘汰最久未使用的条目"""
+    
+    def __init__(self, directory="image_cache", max_bytes=512 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory, exist_ok=True)
+        self.total_bytes = sum(entry.stat().st_size for entry in os.scandir(self.directory)
+                               if entry.name.endswith(".img"))
+        
+    def make_key(self, image, settings):
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(f"{image.mode}|{image.size}|{settings}|".encode())
+        digest.update(image.tobytes())
+        return digest.hexdigest()
+        
+    def get(self, key):
+        path = os.path.join(self.directory, key + ".img")
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        
+        # 文件头或数据流损坏（磁盘错误、被其他程序改写）时当作未命中，删除条目后重新编码
+        try:
+            header, stream = data.split(b"\n", 1)
+            width, height, color_space, bits = header.decode("ascii").split()
+            width, height, bits = int(width), int(height), int(bits)
+            if not self.stream_plausible(width, height, color_space, bits, stream):
+                raise ValueError(f"缓存条目数据流长度不符: {path}")
+        except ValueError:  # UnicodeDecodeError 也是 ValueError
+            self.discard(path, len(data))
+            return None
+        
+        try:
+            # 用修改时间记录最近一次使用，淘汰时先删最旧的
+            os.utime(path)
+        except OSError:
+            pass
+        return width, height, color_space, bits, stream
+        
+    @staticmethod
+    def stream_plausible(width, height, color_space, bits, stream):
+        """按尺寸和位深估算未压缩数据的长度，检查压缩后的数据流长度是否落在 zlib 可能输出的范围内"""
+        channels = {"DeviceGray": 1, "DeviceRGB": 3}.get(color_space)
+        if channels is None or bits not in (1, 8) or width <= 0 or height <= 0:
+            return False
+        raw_size = (width * channels * bits + 7) // 8 * height
+        # deflate 压缩比最高约 1032:1（这里留出余量），最坏情况下存储块只比原始数据多少量开销
+        return raw_size // 1100 <= len(stream) <= raw_size + (raw_size >> 12) + (raw_size >> 14) + 64
+        
+    def discard(self, path, size):
+        try:
+            os.remove(path)
+        except OSError:
+            return
+        self.total_bytes = max(0, self.total_bytes - size)
+        
+    def put(self, key, entry):
+        width, height, color_space, bits, stream = entry
+        path = os.path.join(self.directory, key + ".img")
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(f"{width} {height} {color_space} {bits}\n".encode())
+            f.write(stream)
+        os.replace(temp_path, path)
+        
+        self.total_bytes += os.path.getsize(path)
+        if self.total_bytes > self.max_bytes:
+            self.evict()
             
-        c = canvas.Canvas(filename, pagesize=pagesize)
-        page_width, page_height = pagesize
+    def evict(self):
+        """删除最久未使用的条目，直到占用降到上限的90%以下"""
+        entries = sorted(
+            (entry.stat().st_mtime, entry.stat().st_size, entry.path)
+            for entry in os.scandir(self.directory) if entry.name.endswith(".img")
+        )
+        self.total_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self.total_bytes <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.total_bytes -= size
+
+class FrameDrawer:
+    """把截图画到PDF画布上，保存图像编码选项和跨页共享的状态"""
+    
+    def __init__(self, tile_size=0, color_mode="color", cache_dir=None,
+                 cache_size=512 * 1024 * 1024, min_shared=0.1):
+        self.tile_size = tile_size
+        self.color_mode = color_mode
+        self.min_shared = min_shared  # 重复分块占截图面积的比例低于此值时按整张截图嵌入
+        self.seen_tiles = set()  # 已出现过的分块摘要，不保留像素
+        self.cache = ImageCache(cache_dir, cache_size) if cache_dir else None
+        
+        if np is None and (self.tile_size or color_mode in ("auto", "bilevel")):
+            raise RuntimeError("分块去重和自动/黑白颜色模式需要先安装 numpy (pip install numpy)")
+        
+    def draw(self, c, screenshot, x, y, width, height):
+        if self.cache is not None and not self.tile_size:
+            self.draw_cached(c, screenshot, x, y, width, height)
+            return
         
-        if layout_mode == "每页一张图片":
-            # 每页一张图片
-            for i, (screenshot, img_name) in enumerate(self.screenshots):
-                if i > 0:
-                    c.showPage()
-                    
-                img_width, img_height = screenshot.size
-                
-                scale_x = (page_width - 100) / img_width
-                scale_y = (page_height - 150) / img_height
-                scale = min(scale_x, scale_y)
-                
-                new_width = img_width * scale
-                new_height = img_height * scale
-                
-                x = (page_width - new_width) / 2
-                y = page_height - new_height - 50
-                
-                temp_path = f"temp_{i}.png"
-                screenshot.save(temp_path)
-                
-                c.drawImage(temp_path, x, y, width=new_width, height=new_height)
-                # c.setFont("Helvetica", 12)
-                # c.drawString(50, page_height - 30, f"截图 {i+1}: {os.path.basename(img_name)}")
-                
-                os.remove(temp_path)
-                
-        elif "上下排列" in layout_mode:
-            # 每页两张图片，上下排列（竖向纸张）
-            for i in range(0, len(self.screenshots), 2):
-                if i > 0:
-                    c.showPage()
-                
-                # 上半部分图片
-                screenshot1, img_name1 = self.screenshots[i]
-                img_width1, img_height1 = screenshot1.size
-                
-                # 为上下布局预留更多空间，减少边距
-                available_height = (page_height - 120) / 2  # 减少总边距
-                margin = 50
-                
-                scale_x1 = (page_width - 2 * margin) / img_width1
-                scale_y1 = available_height / img_height1
-                scale1 = min(scale_x1, scale_y1)
-                
-                new_width1 = img_width1 * scale1
-                new_height1 = img_height1 * scale1
-                
-                x1 = (page_width - new_width1) / 2
-                y1 = page_height - new_height1 - margin
-                
-                temp_path1 = f"temp_{i}_1.png"
-                screenshot1.save(temp_path1)
-                
-                c.drawImage(temp_path1, x1, y1, width=new_width1, height=new_height1)
-                # c.setFont("Helvetica", 10)
-                # c.drawString(margin, page_height - 30, f"截图 {i+1}: {os.path.basename(img_name1)}")
-                
-                os.remove(temp_path1)
-                
-                # 下半部分图片（如果存在）
-                if i + 1 < len(self.screenshots):
-                    screenshot2, img_name2 = self.screenshots[i + 1]
-                    img_width2, img_height2 = screenshot2.size
-                    
-                    scale_x2 = (page_width - 2 * margin) / img_width2
-                    scale_y2 = available_height / img_height2
-                    scale2 = min(scale_x2, scale_y2)
-                    
-                    new_width2 = img_width2 * scale2
-                    new_height2 = img_height2 * scale2
-                    
-                    x2 = (page_width - new_width2) / 2
-                    # 修改：第二张图从页面中央开始，而不是紧贴第一张图
-                    y2 = page_height / 2 - new_height2 / 2 - 120
-                    
-                    temp_path2 = f"temp_{i}_2.png"
-                    screenshot2.save(temp_path2)
-                    
-                    c.drawImage(temp_path2, x2, y2, width=new_width2, height=new_height2)
-                    # c.drawString(margin, page_height / 2 - 20, f"截图 {i+2}: {os.path.basename(img_name2)}")
-                    
-                    os.remove(temp_path2)
-                    
-        elif "左右排列" in layout_mode:
-            # 每页两张图片，左右排列（横向纸张）
-            for i in range(0, len(self.screenshots), 2):
-                if i > 0:
-                    c.showPage()
+        screenshot = reduce_colors(screenshot, self.color_mode)
+        if self.tile_size:
+            self.draw_tiles(c, screenshot, x, y, width, height)
+        else:
+            draw_image(c, screenshot, x, y, width, height)
+            
+    def draw_cached(self, c, screenshot, x, y, width, height):
+        """像素和编码设置都相同的截图直接使用缓存中的数据流，不再做颜色转换和压缩"""
+        key = self.cache.make_key(screenshot, f"flate6|{self.color_mode}")
+        
+        def encode():
+            entry = self.cache.get(key)
+            if entry is None:
+                entry = encode_image(reduce_colors(screenshot, self.color_mode))
+                self.cache.put(key, entry)
+            return entry
+        
+        draw_image_stream(c, "cached_" + key, encode, x, y, width, height)
+        
+    def split_tiles(self, pixels):
+        """把整张截图切成 tile_size 见方的分块视图 (行, 列, 分块像素字节)，边缘不足一块的部分按边缘像素补齐；
+        同时向量化地找出纯色分块"""
+        img_height, img_width, channels = pixels.shape
+        t = self.tile_size
+        rows = (img_height + t - 1) // t
+        cols = (img_width + t - 1) // t
+        
+        padded = np.pad(pixels, ((0, rows * t - img_height), (0, cols * t - img_width), (0, 0)), mode="edge")
+        tiles = padded.reshape(rows, t, cols, t, channels).swapaxes(1, 2).reshape(rows, cols, t * t, channels)
+        uniform = (tiles == tiles[:, :, :1]).all(axis=(2, 3))
+        return np.ascontiguousarray(tiles).reshape(rows, cols, -1), uniform
+        
+    def draw_tiles(self, c, screenshot, x, y, width, height):
+        """之前的截图中出现过的分块（工具栏、页眉、侧边栏等）单独嵌入一次，各页面引用同一个图像对象；
+        其余不重复的区域仍合成一张图像嵌入，避免每个分块各自承担图像对象和压缩的开销"""
+        if screenshot.mode not in ("1", "L", "RGB"):
+            screenshot = screenshot.convert("RGB")
+        pixels = np.asarray(screenshot)
+        if pixels.ndim == 2:
+            pixels = pixels[:, :, None]
+        img_height, img_width = pixels.shape[:2]
+        t = self.tile_size
+        tiles, uniform = self.split_tiles(pixels)
+        
+        shared = []  # (分块x, 分块y, 宽, 高, 摘要)
+        shared_area = 0
+        # 纯色分块在整张图像中几乎不占空间，单独嵌入反而更大
+        for row, col in zip(*np.nonzero(~uniform)):
+            tile_x, tile_y = int(col) * t, int(row) * t
+            tile_width = min(t, img_width - tile_x)
+            tile_height = min(t, img_height - tile_y)
+            # 只保留摘要不保留像素，摘要必须足够强，不能再靠逐字节比较排除碰撞
+            digest = hashlib.blake2b(f"{screenshot.mode}|{tile_width}x{tile_height}|".encode(), digest_size=16)
+            digest.update(tiles[row, col])
+            digest = digest.hexdigest()
+            if digest in self.seen_tiles:
+                shared.append((tile_x, tile_y, tile_width, tile_height, digest))
+                shared_area += tile_width * tile_height
+            else:
+                self.seen_tiles.add(digest)
+        
+        if shared_area < self.min_shared * img_width * img_height:
+            draw_image(c, screenshot, x, y, width, height)
+            return
+        
+        # 重复分块内部填成该分块的平均色，剩余内容作为一张图像垫在分块下面；
+        # 分块最外一圈保留原像素，阅读器缩放插值和分块边缘抗锯齿时取到的仍是正确的颜色
+        residual = pixels.copy()
+        for tile_x, tile_y, tile_width, tile_height, _ in shared:
+            inner = residual[tile_y + 1:tile_y + tile_height - 1, tile_x + 1:tile_x + tile_width - 1]
+            if inner.dtype == bool:
+                inner[...] = inner.mean() >= 0.5
+            else:
+                inner[...] = inner.mean(axis=(0, 1)).round().astype(np.uint8)
+        
+        def as_image(array):
+            return Image.fromarray(np.ascontiguousarray(array[:, :, 0] if array.shape[2] == 1 else array))
+        
+        residual_image = as_image(residual)
+        draw_image_stream(c, "frame_" + hashlib.blake2b(residual.tobytes(), digest_size=16).hexdigest(),
+                          lambda: encode_image(residual_image), x, y, width, height)
+        
+        scale_x = width / img_width
+        scale_y = height / img_height
+        for tile_x, tile_y, tile_width, tile_height, digest in shared:
+            tile = pixels[tile_y:tile_y + tile_height, tile_x:tile_x + tile_width]
+            draw_image_stream(
+                c,
+                "tile_" + digest,
+                lambda tile=tile: encode_image(as_image(tile)),
+                x + tile_x * scale_x,
+                y + height - (tile_y + tile_height) * scale_y,
+                tile_width * scale_x,
+                tile_height * scale_y
+            )
+
+def draw_pdf_pages(c, screenshots, layout_mode, pagesize, drawer, progress=None):
+    """按布局把截图逐页绘制到画布上，每画完一页调用 progress(已完成页数, 总页数)"""
+    page_width, page_height = pagesize
+    images_per_page = get_images_per_page(layout_mode)
+    total_pages = (len(screenshots) + images_per_page - 1) // images_per_page
+    
+    if layout_mode == "每页一张图片":
+        # 每页一张图片
+        for i, (screenshot, img_name) in enumerate(screenshots):
+            if i > 0:
+                c.showPage()
+            
+            screenshot = load_frame(screenshot, img_name)
+            img_width, img_height = screenshot.size
+            
+            scale_x = (page_width - 100) / img_width
+            scale_y = (page_height - 150) / img_height
+            scale = min(scale_x, scale_y)
+            
+            new_width = img_width * scale
+            new_height = img_height * scale
+            
+            x = (page_width - new_width) / 2
+            y = page_height - new_height - 50
+            
+            drawer.draw(c, screenshot, x, y, new_width, new_height)
+            # c.setFont("Helvetica", 12)
+            # c.drawString(50, page_height - 30, f"截图 {i+1}: {os.path.basename(img_name)}")
+            
+            if progress:
+                progress(i + 1, total_pages)
+            
+    elif "上下排列" in layout_mode:
+        # 每页两张图片，上下排列（竖向纸张）
+        for i in range(0, len(screenshots), 2):
+            if i > 0:
+                c.showPage()
+            
+            # 上半部分图片
+            screenshot1 = load_frame(*screenshots[i])
+            img_width1, img_height1 = screenshot1.size
+            
+            # 为上下布局预留更多空间，减少边距
+            available_height = (page_height - 120) / 2  # 减少总边距
+            margin = 50
+            
+            scale_x1 = (page_width - 2 * margin) / img_width1
+            scale_y1 = available_height / img_height1
+            scale1 = min(scale_x1, scale_y1)
+            
+            new_width1 = img_width1 * scale1
+            new_height1 = img_height1 * scale1
+            
+            x1 = (page_width - new_width1) / 2
+            y1 = page_height - new_height1 - margin
+            
+            drawer.draw(c, screenshot1, x1, y1, new_width1, new_height1)
+            # c.setFont("Helvetica", 10)
+            # c.drawString(margin, page_height - 30, f"截图 {i+1}: {os.path.basename(img_name1)}")
+            
+            # 下半部分图片（如果存在）
+            if i + 1 < len(screenshots):
+                screenshot2 = load_frame(*screenshots[i + 1])
+                img_width2, img_height2 = screenshot2.size
                 
-                # 左侧图片
-                screenshot1, img_name1 = self.screenshots[i]
-                img_width1, img_height1 = screenshot1.size
+                scale_x2 = (page_width - 2 * margin) / img_width2
+                scale_y2 = available_height / img_height2
+                scale2 = min(scale_x2, scale_y2)
                 
-                # 横向纸张的优化布局
-                margin = 40
-                center_gap = 20  # 中间间隔
-                available_width = (page_width - 2 * margin - center_gap) / 2
-                available_height = page_height - 2 * margin - 40  # 为标题预留空间
+                new_width2 = img_width2 * scale2
+                new_height2 = img_height2 * scale2
                 
-                scale_x1 = available_width / img_width1
-                scale_y1 = available_height / img_height1
-                scale1 = min(scale_x1, scale_y1)
+                x2 = (page_width - new_width2) / 2
+                # 修改：第二张图从页面中央开始，而不是紧贴第一张图
+                y2 = page_height / 2 - new_height2 / 2 - 120
                 
-                new_width1 = img_width1 * scale1
-                new_height1 = img_height1 * scale1
+                drawer.draw(c, screenshot2, x2, y2, new_width2, new_height2)
+                # c.drawString(margin, page_height / 2 - 20, f"截图 {i+2}: {os.path.basename(img_name2)}")
+            
+            if progress:
+                progress(i // 2 + 1, total_pages)
                 
-                # 左侧图片居中对齐
-                x1 = margin + (available_width - new_width1) / 2
-                y1 = margin + (available_height - new_height1) / 2
+    elif "左右排列" in layout_mode:
+        # 每页两张图片，左右排列（横向纸张）
+        for i in range(0, len(screenshots), 2):
+            if i > 0:
+                c.showPage()
+            
+            # 左侧图片
+            screenshot1 = load_frame(*screenshots[i])
+            img_width1, img_height1 = screenshot1.size
+            
+            # 横向纸张的优化布局
+            margin = 40
+            center_gap = 20  # 中间间隔
+            available_width = (page_width - 2 * margin - center_gap) / 2
+            available_height = page_height - 2 * margin - 40  # 为标题预留空间
+            
+            scale_x1 = available_width / img_width1
+            scale_y1 = available_height / img_height1
+            scale1 = min(scale_x1, scale_y1)
+            
+            new_width1 = img_width1 * scale1
+            new_height1 = img_height1 * scale1
+            
+            # 左侧图片居中对齐
+            x1 = margin + (available_width - new_width1) / 2
+            y1 = margin + (available_height - new_height1) / 2
+            
+            drawer.draw(c, screenshot1, x1, y1, new_width1, new_height1)
+            # c.setFont("Helvetica", 10)
+            # c.drawString(margin, page_height - 25, f"截图 {i+1}")
+            
+            # 右侧图片（如果存在）
+            if i + 1 < len(screenshots):
+                screenshot2 = load_frame(*screenshots[i + 1])
+                img_width2, img_height2 = screenshot2.size
                 
-                temp_path1 = f"temp_{i}_1.png"
-                screenshot1.save(temp_path1)
+                scale_x2 = available_width / img_width2
+                scale_y2 = available_height / img_height2
+                scale2 = min(scale_x2, scale_y2)
                 
-                c.drawImage(temp_path1, x1, y1, width=new_width1, height=new_height1)
-                # c.setFont("Helvetica", 10)
-                # c.drawString(margin, page_height - 25, f"截图 {i+1}")
+                new_width2 = img_width2 * scale2
+                new_height2 = img_height2 * scale2
                 
-                os.remove(temp_path1)
+                # 右侧图片居中对齐
+                x2 = margin + available_width + center_gap + (available_width - new_width2) / 2
+                y2 = margin + (available_height - new_height2) / 2
                 
-                # 右侧图片（如果存在）
-                if i + 1 < len(self.screenshots):
-                    screenshot2, img_name2 = self.screenshots[i + 1]
-                    img_width2, img_height2 = screenshot2.size
-                    
-                    scale_x2 = available_width / img_width2
-                    scale_y2 = available_height / img_height2
-                    scale2 = min(scale_x2, scale_y2)
-                    
-                    new_width2 = img_width2 * scale2
-                    new_height2 = img_height2 * scale2
-                    
-                    # 右侧图片居中对齐
-                    x2 = margin + available_width + center_gap + (available_width - new_width2) / 2
-                    y2 = margin + (available_height - new_height2) / 2
-                    
-                    temp_path2 = f"temp_{i}_2.png"
-                    screenshot2.save(temp_path2)
-                    
-                    c.drawImage(temp_path2, x2, y2, width=new_width2, height=new_height2)
-                    # c.drawString(x2, page_height - 25, f"截图 {i+2}")
-                    
-                    os.remove(temp_path2)
+                drawer.draw(c, screenshot2, x2, y2, new_width2, new_height2)
+                # c.drawString(x2, page_height - 25, f"截图 {i+2}")
             
-        c.save()
+            if progress:
+                progress(i // 2 + 1, total_pages)
+
+def render_pdf(filename, screenshots, layout_mode, progress=None, **encode_options):
+    pagesize = get_pdf_pagesize(layout_mode)
+    c = canvas.Canvas(filename, pagesize=pagesize)
+    draw_pdf_pages(c, screenshots, layout_mode, pagesize, FrameDrawer(**encode_options), progress)
+    c.save()
+
+def split_pdf_shards(total, images_per_page, shard_count):
+    """把截图序列切成连续分片，分片边界总是落在整页上，两图一页不会被拆开；各分片页数最多相差一页"""
+    pages = (total + images_per_page - 1) // images_per_page
+    if pages == 0:
+        return []
+    shard_count = max(1, min(shard_count, pages))
+    base_pages, extra_pages = divmod(pages, shard_count)
+    
+    shards = []
+    start = 0
+    for n in range(shard_count):
+        end = min(start + (base_pages + (1 if n < extra_pages else 0)) * images_per_page, total)
+        shards.append((start, end))
+        start = end
+    return shards
+
+def render_pdf_shard(filename, frames, layout_mode, encode_options, shard_progress=None, index=0,
+                     cancel_event=None):
+    """子进程入口：根据截图文件或暂存帧位置渲染一个分片，每画完一页把页数写入 shard_progress[index]，
+    cancel_event 被设置后在下一页停下"""
+    def report(done, total):
+        if cancel_event is not None and cancel_event.is_set():
+            raise ExportCancelled()
+        shard_progress[index] = done
+    
+    render_pdf(filename, frames, layout_mode,
+               progress=report if shard_progress is not None else None, **encode_options)
+    return filename
+
+def merge_pdf_files(part_files, filename, linearize=False, compact=False):
+    """直接拷贝各分片的页面对象合并，不重新渲染"""
+    if not part_files:
+        raise ValueError("没有可合并的分卷PDF")
+    
+    merged = pikepdf.new()
+    sources = []
+    try:
+        for part_file in part_files:
+            source = pikepdf.open(part_file)
+            sources.append(source)
+            merged.pages.extend(source.pages)
+        if compact:
+            share_page_resources(merged)
+        merged.save(filename, **pdf_save_options(linearize, compact))
+    finally:
+        for source in sources:
+            source.close()
+
+def render_pdf_sharded(filename, screenshots, layout_mode, workers=None, keep_volumes=False,
+                       linearize=False, compact=False, volume_base=None, progress=None,
+                       **encode_options):
+    """分片并行渲染后合并；volume_base 指定分卷文件的命名，默认跟随输出文件名"""
+    if pikepdf is None:
+        raise RuntimeError("分片生成PDF需要先安装 pikepdf (pip install pikepdf)")
+    
+    workers = workers or os.cpu_count() or 1
+    images_per_page = get_images_per_page(layout_mode)
+    shards = split_pdf_shards(len(screenshots), images_per_page, workers)
+    if not shards:
+        raise ValueError("没有截图可生成PDF")
+    # 内存中的图像不传给子进程，只传文件名；暂存帧只传位置信息
+    frames = [(screenshot if isinstance(screenshot, SpoolFrame) else None, img_name)
+              for screenshot, img_name in screenshots]
+    base_name = os.path.splitext(volume_base or filename)[0]
+    part_files = [f"{base_name}_vol{n + 1:03d}.pdf" for n in range(len(shards))]
+    
+    def shard_pages(n):
+        start, end = shards[n]
+        return (end - start + images_per_page - 1) // images_per_page
+    
+    total_pages = sum(shard_pages(n) for n in range(len(shards)))
+    
+    try:
+        failed = []
+        # 各分片每画完一页都更新自己的页数，主线程定时汇总，进度按页而不是按分片更新
+        with multiprocessing.Manager() as manager:
+            shard_progress = manager.list([0] * len(shards))
+            cancel_event = manager.Event()
+            with ProcessPoolExecutor(max_workers=min(workers, len(shards))) as pool:
+                futures = {
+                    pool.submit(render_pdf_shard, part_files[n], frames[start:end], layout_mode,
+                                encode_options, shard_progress, n, cancel_event): n
+                    for n, (start, end) in enumerate(shards)
+                }
+                try:
+                    pending = set(futures)
+                    while pending:
+                        finished, pending = wait(pending, timeout=0.2)
+                        for future in finished:
+                            n = futures[future]
+                            if future.exception() is not None:
+                                print(f"Debug: 分片 {n + 1} 生成失败: {future.exception()}")
+                                failed.append(n)
+                        done_pages = shard_progress[:]
+                        if progress:
+                            progress(sum(done_pages), total_pages)
+                except BaseException:
+                    # 取消或出错时不再启动排队中的分片，正在渲染的分片画完当前页就停下
+                    cancel_event.set()
+                    for future in futures:
+                        future.cancel()
+                    raise
+        
+        # 只重做失败的分片
+        for n in sorted(failed):
+            start, end = shards[n]
+            done_pages[n] = 0
+            
+            def report(done, total, n=n):
+                done_pages[n] = done
+                if progress:
+                    progress(sum(done_pages), total_pages)
+            
+            render_pdf(part_files[n], frames[start:end], layout_mode, progress=report, **encode_options)
+        
+        merge_pdf_files(part_files, filename, linearize=linearize, compact=compact)
+    finally:
+        if not keep_volumes:
+            for part_file in part_files:
+                if os.path.exists(part_file):
+                    os.remove(part_file)
+
+def write_pdf(filename, screenshots, layout_mode, sharded=False, keep_volumes=False,
+              linearize=False, compact=False, volume_base=None, progress=None, **encode_options):
+    """完整的PDF输出流程：渲染（单进程或分片并行）、结构重写和校验"""
+    if sharded:
+        # 分片并行生成，最后合并为一个文件
+        render_pdf_sharded(filename, screenshots, layout_mode,
+                           keep_volumes=keep_volumes, linearize=linearize, compact=compact,
+                           volume_base=volume_base, progress=progress, **encode_options)
+    else:
+        render_pdf(filename, screenshots, layout_mode, progress=progress, **encode_options)
+        if linearize or compact:
+            rewrite_pdf(filename, linearize=linearize, compact=compact)
+    
+    if linearize and not verify_linearized(filename):
+        raise RuntimeError("线性化校验失败，请检查 pikepdf 版本")
+
+def write_zip(filename, screenshots, progress=None):
+    """按顺序把截图PNG以不压缩(stored)方式逐个写入ZIP/CBZ，内存占用与截图数量无关"""
+    total = len(screenshots)
+    with zipfile.ZipFile(filename, "w", compression=zipfile.ZIP_STORED, allowZip64=True) as zf:
+        for n, (screenshot, img_name) in enumerate(screenshots):
+            # 序号前缀保证阅读器按截图顺序排列
+            arcname = f"{n + 1:05d}_{os.path.basename(img_name)}"
+            if os.path.exists(img_name):
+                zf.write(img_name, arcname)
+            else:
+                # PNG尚未落盘时直接编码进压缩包
+                with zf.open(arcname, "w") as f:
+                    load_frame(screenshot, img_name).save(f, format="PNG")
+            if progress:
+                progress(n + 1, total)
+
+def write_tiff(filename, screenshots, progress=None):
+    """逐帧追加写入多页TIFF，每次只在内存中保留一张截图
+    
+    使用64位偏移的 BigTIFF：未压缩的截图几百张就会超过经典TIFF 4GB 的偏移上限。
+    """
+    total = len(screenshots)
+    with TiffImagePlugin.AppendingTiffWriter(filename, True) as tf:
+        for n, (screenshot, img_name) in enumerate(screenshots):
+            frame = load_frame(screenshot, img_name)
+            frame.save(tf, format="TIFF", big_tiff=True)
+            tf.newFrame()
+            if progress:
+                progress(n + 1, total)
+
+def pdf_save_options(linearize=False, compact=False):
+    """linearize: 线性化（快速网页浏览）；compact: PDF 1.5 对象流和压缩的交叉引用流"""
+    options = {"linearize": linearize}
+    if compact:
+        options.update(
+            object_stream_mode=pikepdf.ObjectStreamMode.generate,
+            compress_streams=True,
+            # 解开 reportlab 默认加的 ASCII85 编码，只保留 Flate 压缩
+            stream_decode_level=pikepdf.StreamDecodeLevel.generalized,
+            min_version="1.5"
+        )
+    return options
+
+def share_page_resources(pdf):
+    """内容相同的页面资源（ProcSet、字体等）和整份资源字典只保留一个共享的间接对象"""
+    shared = {}
+    
+    def share(obj):
+        if obj.is_indirect:
+            return obj
+        key = bytes(obj.unparse())
+        if key not in shared:
+            shared[key] = pdf.make_indirect(obj)
+        return shared[key]
+    
+    for page in pdf.pages:
+        resources = page.obj.get("/Resources")
+        if resources is None:
+            continue
+        for name in ("/ProcSet", "/Font", "/ExtGState", "/ColorSpace"):
+            if name in resources:
+                resources[name] = share(resources[name])
+        page.obj.Resources = share(resources)
+
+def rewrite_pdf(filename, linearize=False, compact=False):
+    """用 pikepdf 重写PDF结构：线性化时首页对象和提示表放在文件开头，紧凑时使用对象流并共享页面资源"""
+    if pikepdf is None:
+        raise RuntimeError("线性化和紧凑结构输出需要先安装 pikepdf (pip install pikepdf)")
+    
+    temp_filename = filename + ".tmp"
+    try:
+        with pikepdf.open(filename) as pdf:
+            if compact:
+                share_page_resources(pdf)
+            pdf.save(temp_filename, **pdf_save_options(linearize, compact))
+        os.replace(temp_filename, filename)
+    finally:
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+
+def verify_linearized(filename):
+    """检查文件开头的线性化字典与实际文件长度、页数一致，并校验提示表"""
+    with open(filename, "rb") as f:
+        head = f.read(1024)
+    
+    match = re.search(rb"<<\s*/Linearized\s+[\d.]+(.*?)>>", head, re.S)
+    if not match:
+        return False
+    
+    params = dict(
+        (key.decode(), int(value))
+        for key, value in re.findall(rb"/([LNOT])\s+(\d+)", match.group(1))
+    )
+    if params.get("L") != os.path.getsize(filename):
+        return False
+    
+    with pikepdf.open(filename) as pdf:
+        return (pdf.is_linearized and params.get("N") == len(pdf.pages)
+                and pdf.check_linearization(io.StringIO()))
 
 def main():
     app = QApplication(sys.argv)
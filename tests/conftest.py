@@ -0,0 +1,24 @@
+import os
+import sys
+
+import pytest
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def make_frames(tmp_path):
+    """返回生成测试截图的函数：深色标题栏上是浅色标题，白底上是各页不同的正文，
+    每项为 (图像, 截图文件名)，与程序中的截图列表格式一致"""
+    def make(count=3, title="Title", size=(320, 200)):
+        frames = []
+        for n in range(count):
+            image = Image.new("RGB", size, "white")
+            draw = ImageDraw.Draw(image)
+            draw.rectangle([0, 0, size[0], 40], fill=(40, 60, 120))
+            draw.text((10, 15), title, fill="white")
+            draw.text((10, 80), f"Page {n + 1}", fill="black")
+            frames.append((image, str(tmp_path / f"screenshot_{n:03d}.png")))
+        return frames
+    return make
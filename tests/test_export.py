@@ -0,0 +1,32 @@
+import zipfile
+
+import pytest
+from PIL import Image
+
+pdf = pytest.importorskip("pdf", reason="pdf.py 需要先安装 PyQt5 和 pyautogui")
+
+
+def test_write_tiff_uses_bigtiff_and_keeps_frame_order(tmp_path, make_frames):
+    frames = make_frames()
+    filename = str(tmp_path / "frames.tif")
+    pdf.write_tiff(filename, frames)
+    
+    with open(filename, "rb") as f:
+        # BigTIFF 文件头的版本号是 43，经典TIFF是 42
+        assert f.read(4) in (b"II+\x00", b"MM\x00+")
+    with Image.open(filename) as tiff:
+        assert tiff.n_frames == len(frames)
+        for n, (image, _) in enumerate(frames):
+            tiff.seek(n)
+            assert tiff.convert("RGB").tobytes() == image.tobytes()
+
+
+def test_write_zip_encodes_frames_without_png_files(tmp_path, make_frames):
+    frames = make_frames()
+    filename = str(tmp_path / "frames.cbz")
+    pdf.write_zip(filename, frames)
+    
+    with zipfile.ZipFile(filename) as zf:
+        names = zf.namelist()
+        assert names == [f"{n + 1:05d}_screenshot_{n:03d}.png" for n in range(len(frames))]
+        assert all(info.compress_type == zipfile.ZIP_STORED for info in zf.infolist())
@@ -0,0 +1,47 @@
+"""紧凑结构输出（对象流、交叉引用流、共享资源）与普通输出逐页比较，显示内容必须完全一致"""
+import pytest
+
+pdf = pytest.importorskip("pdf", reason="pdf.py 需要先安装 PyQt5 和 pyautogui")
+
+pikepdf = pytest.importorskip("pikepdf")
+
+LAYOUTS = [
+    "每页一张图片",
+    "每页两张图片(上下排列-竖向纸张)",
+    "每页两张图片(左右排列-横向纸张)",
+]
+
+
+def page_snapshot(page):
+    """页面尺寸、解码后的内容流和每个图像解码后的像素"""
+    images = {}
+    for name, xobject in page.Resources.XObject.items():
+        if xobject.Subtype == "/Image":
+            image = pikepdf.PdfImage(xobject).as_pil_image()
+            images[str(name)] = (image.mode, image.size, image.tobytes())
+    contents = page.obj.Contents
+    if isinstance(contents, pikepdf.Array):
+        content = b"".join(stream.read_bytes() for stream in contents)
+    else:
+        content = contents.read_bytes()
+    return [float(v) for v in page.MediaBox], content, images
+
+
+@pytest.mark.parametrize("layout_mode", LAYOUTS)
+def test_compact_output_matches_classic(tmp_path, make_frames, layout_mode):
+    frames = make_frames(5)
+    classic = str(tmp_path / "classic.pdf")
+    compact = str(tmp_path / "compact.pdf")
+    pdf.write_pdf(classic, frames, layout_mode)
+    pdf.write_pdf(compact, frames, layout_mode, compact=True)
+    
+    with pikepdf.open(classic) as classic_pdf, pikepdf.open(compact) as compact_pdf:
+        assert len(compact_pdf.pages) == len(classic_pdf.pages)
+        assert compact_pdf.pdf_version >= "1.5"
+        for classic_page, compact_page in zip(classic_pdf.pages, compact_pdf.pages):
+            assert page_snapshot(compact_page) == page_snapshot(classic_page)
+    
+    with open(compact, "rb") as f:
+        data = f.read()
+    assert b"/ObjStm" in data
+    assert b"/XRef" in data
@@ -0,0 +1,71 @@
+"""draw_image_stream 直接使用 reportlab 的内部接口登记图像，这里渲染出PDF再解码图像流，
+reportlab 升级后内部接口变化时能及时发现"""
+import numpy as np
+import pytest
+
+pdf = pytest.importorskip("pdf", reason="pdf.py 需要先安装 PyQt5 和 pyautogui")
+
+pikepdf = pytest.importorskip("pikepdf")
+
+
+def page_images(filename):
+    with pikepdf.open(filename) as doc:
+        return [
+            [pikepdf.PdfImage(xobject).as_pil_image()
+             for xobject in page.Resources.XObject.values() if xobject.Subtype == "/Image"]
+            for page in doc.pages
+        ]
+
+
+def test_bilevel_image_is_embedded_as_1bit(tmp_path, make_frames):
+    [(frame, _)] = make_frames(1)
+    filename = str(tmp_path / "bilevel.pdf")
+    pdf.render_pdf(filename, [(frame, "frame.png")], "每页一张图片", color_mode="bilevel")
+    
+    [[image]] = page_images(filename)
+    assert image.mode == "1"
+    expected = pdf.adaptive_threshold(frame.convert("L"))
+    assert np.array_equal(np.asarray(image), np.asarray(expected))
+
+
+def test_cached_image_renders_same_pixels(tmp_path, make_frames):
+    [(frame, _)] = make_frames(1)
+    cache_dir = str(tmp_path / "cache")
+    for n in range(2):
+        # 第二次直接使用缓存中的数据流
+        filename = str(tmp_path / f"cached_{n}.pdf")
+        pdf.render_pdf(filename, [(frame, "frame.png")], "每页一张图片", cache_dir=cache_dir)
+        [[image]] = page_images(filename)
+        assert image.tobytes() == frame.tobytes()
+
+
+def test_adaptive_threshold_keeps_light_text_on_dark_bar(make_frames):
+    [(frame, _)] = make_frames(1, title="File  Edit  View")
+    frame = frame.convert("L")
+    pixels = np.asarray(pdf.adaptive_threshold(frame))
+    
+    # 标题栏背景为黑色，栏上的浅色文字保留为白色
+    assert not pixels[2:10, 200:310].any()
+    assert pixels[12:28, 8:110].any()
+    # 白底上的深色文字为黑色，空白处为白色
+    assert not pixels[78:92, 8:80].all()
+    assert pixels[150:190].all()
+
+
+@pytest.mark.parametrize("corrupt", [
+    b"\xff\xfe garbage\n",  # 文件头不是 ASCII
+    b"640 480 DeviceRGB\nxx",  # 文件头缺字段
+    b"640 480 DeviceRGB 8\n" + b"x" * 10,  # 数据流长度与尺寸不符
+])
+def test_corrupt_cache_entry_is_reencoded(tmp_path, make_frames, corrupt):
+    [(frame, _)] = make_frames(1)
+    cache_dir = str(tmp_path / "cache")
+    filename = str(tmp_path / "cached.pdf")
+    pdf.render_pdf(filename, [(frame, "frame.png")], "每页一张图片", cache_dir=cache_dir)
+    [entry] = (tmp_path / "cache").glob("*.img")
+    entry.write_bytes(corrupt)
+    
+    pdf.render_pdf(filename, [(frame, "frame.png")], "每页一张图片", cache_dir=cache_dir)
+    [[image]] = page_images(filename)
+    assert image.tobytes() == frame.tobytes()
+    assert entry.read_bytes() != corrupt
@@ -0,0 +1,23 @@
+import pytest
+
+pdf = pytest.importorskip("pdf", reason="pdf.py 需要先安装 PyQt5 和 pyautogui")
+
+
+def test_split_spreads_pages_evenly_and_keeps_two_up_pages_together():
+    # 7 张两图一页共 4 页，3 个进程各分到 2/1/1 页，最后一页只有一张图
+    assert pdf.split_pdf_shards(7, 2, 3) == [(0, 4), (4, 6), (6, 7)]
+
+
+def test_split_without_frames_returns_no_shards():
+    assert pdf.split_pdf_shards(0, 2, 4) == []
+
+
+def test_split_with_more_workers_than_pages():
+    assert pdf.split_pdf_shards(3, 1, 8) == [(0, 1), (1, 2), (2, 3)]
+    assert pdf.split_pdf_shards(3, 2, 8) == [(0, 2), (2, 3)]
+
+
+def test_sharded_render_rejects_empty_input(tmp_path):
+    pytest.importorskip("pikepdf")
+    with pytest.raises(ValueError):
+        pdf.render_pdf_sharded(str(tmp_path / "empty.pdf"), [], "每页一张图片")
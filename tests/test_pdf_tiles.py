@@ -0,0 +1,48 @@
+"""分块去重的页面渲染出来必须与整张嵌入的页面一致"""
+import numpy as np
+import pytest
+from reportlab.pdfgen import canvas
+
+pdf = pytest.importorskip("pdf", reason="pdf.py 需要先安装 PyQt5 和 pyautogui")
+
+pdfium = pytest.importorskip("pypdfium2")
+
+
+def render_frames(filename, frames, **encode_options):
+    """每页按 1:1 画一张截图，分块边界落在整数设备像素上，渲染结果可以逐像素比较"""
+    width, height = frames[0][0].size
+    c = canvas.Canvas(filename, pagesize=(width, height))
+    drawer = pdf.FrameDrawer(**encode_options)
+    for n, (image, _) in enumerate(frames):
+        if n:
+            c.showPage()
+        drawer.draw(c, image, 0, 0, width, height)
+    c.save()
+    return pdfium.PdfDocument(filename)
+
+
+@pytest.mark.parametrize("scale", [1, 0.5])
+def test_tiled_pages_render_same_as_plain(tmp_path, make_frames, scale):
+    frames = make_frames(3)
+    plain = render_frames(str(tmp_path / "plain.pdf"), frames)
+    tiled = render_frames(str(tmp_path / "tiled.pdf"), frames, tile_size=32)
+    
+    for n in range(len(frames)):
+        expected = np.asarray(plain[n].render(scale=scale).to_pil().convert("RGB"))
+        actual = np.asarray(tiled[n].render(scale=scale).to_pil().convert("RGB"))
+        assert np.array_equal(actual, expected), f"第 {n + 1} 页渲染结果不同"
+
+
+def test_repeated_title_bar_is_embedded_once(tmp_path, make_frames):
+    pikepdf = pytest.importorskip("pikepdf")
+    filename = str(tmp_path / "tiled.pdf")
+    render_frames(filename, make_frames(3), tile_size=32).close()
+    
+    with pikepdf.open(filename) as doc:
+        tile_names = [
+            {str(name) for name in page.Resources.XObject.keys() if "tile_" in str(name)}
+            if "/XObject" in page.Resources else set()
+            for page in doc.pages
+        ]
+    # 之后各页引用同一组标题栏分块，只嵌入一次
+    assert tile_names[1] and tile_names[1] == tile_names[2]
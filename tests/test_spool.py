@@ -0,0 +1,27 @@
+import os
+
+import pytest
+
+pdf = pytest.importorskip("pdf", reason="pdf.py 需要先安装 PyQt5 和 pyautogui")
+
+
+def test_leftover_spool_is_recovered_and_removed(tmp_path, make_frames, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("screenshots")
+    frames = make_frames(3)
+    spool = pdf.FrameSpool("screenshots/spool_test.raw")
+    for image, img_name in frames:
+        spool.append(image, img_name)
+    # 模拟写入最后一帧时崩溃：像素不完整，索引行的文件名被截断且没有换行符
+    spool.file.write(b"\0" * 10)
+    spool.index_file.write(f"{spool.offset}\t10\tRGB\t2\t2\tscreenshots/scr")
+    spool.finish()
+    
+    [recovered] = pdf.load_leftover_spools()
+    assert [img_name for _, img_name in recovered.frames] == [img_name for _, img_name in frames]
+    assert recovered.encode_all()
+    
+    assert sorted(os.listdir("screenshots")) == []
+    for image, img_name in frames:
+        assert os.path.exists(img_name)
+        assert pdf.Image.open(img_name).tobytes() == image.tobytes()